@@ -9,7 +9,7 @@ sys.path.append(str(project_root))
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 import os
 import logging
@@ -29,6 +29,7 @@ logger.info(f"Using data directory: {DATA_DIR}")
 
 
 from data.src.rag.rag import IslamicRAG
+from data.src.rag.embedding_batcher import EmbeddingQueueFullError
 from data.src.config.env_manager import env_manager
 
 # Add startup/shutdown events
@@ -133,23 +134,32 @@ class QuestionRequest(BaseModel):
     question: str
     source_type: Optional[str] = None  # 'hadith' or 'quran'
     sect: Optional[str] = None  # 'sunni' or 'shia'
+    context_window: int = Field(default=0, ge=0, le=5)  # neighboring verses/hadith per source
 
     model_config = {
         "json_schema_extra": {
             "example": {
                 "question": "What does Islam say about intentions?",
                 "source_type": "hadith",
-                "sect": "sunni"
+                "sect": "sunni",
+                "context_window": 1
             }
         }
     }
 
+class ContextSource(BaseModel):
+    text: str
+    translation: Optional[str]
+    source: str
+    type: str
+
 class Source(BaseModel):
     text: str
     translation: Optional[str]
     source: str
     type: str
     score: float
+    context: Optional[List[ContextSource]] = None
 
 class AnswerResponse(BaseModel):
     answer: str
@@ -168,6 +178,7 @@ async def ask_question(request: QuestionRequest):
     - **question**: Your Islamic question
     - **source_type**: Filter by 'hadith' or 'quran' (optional)
     - **sect**: Filter by 'sunni' or 'shia' (optional)
+    - **context_window**: Neighboring verses/hadith to attach to each source (optional, 0-5)
     """
     try:
         logger.info(f"Processing question: {request.question}")
@@ -185,11 +196,15 @@ async def ask_question(request: QuestionRequest):
             
         answer, sources = await rag.answer_question(
             query=request.question,
-            source_type=request.source_type
+            source_type=request.source_type,
+            context_window=request.context_window
         )
         logger.info("Successfully generated answer")
         return AnswerResponse(answer=answer, sources=sources)
         
+    except EmbeddingQueueFullError as e:
+        logger.warning(f"Shedding load: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except ValueError as e:
         logger.error(f"Validation error: {str(e)}")
         raise HTTPException(status_code=400, detail=str(e))
@@ -215,7 +230,10 @@ async def health_check():
             "version": "1.0.0",
             "environment": os.getenv("ENVIRONMENT", "production"),
             "data_dir_exists": data_dir_exists,
-            "python_path": os.getenv("PYTHONPATH", "not_set")
+            "python_path": os.getenv("PYTHONPATH", "not_set"),
+            "embedding_batcher": rag_instance.query_batcher.stats() if rag_instance else None,
+            "answer_cache": rag_instance.llm.cache.stats()
+                if rag_instance and getattr(rag_instance.llm, 'cache', None) else None
         }
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
@@ -0,0 +1,220 @@
+# data/src/models/answer_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# L2 hits refresh accessed_at (the LRU order) at most this often per entry,
+# so reads rarely turn into writes that contend across workers
+ACCESS_TOUCH_INTERVAL = 300
+
+
+def default_cache_path() -> str:
+    """Resolve the on-disk cache location, mirroring the database directory choice"""
+    if os.getenv('ANSWER_CACHE_PATH'):
+        return os.getenv('ANSWER_CACHE_PATH')
+    if os.getenv('RENDER'):
+        # Render's filesystem (free plan, no disk) is wiped on every restart and
+        # redeploy; set ANSWER_CACHE_PATH to a mounted disk for a cache that lasts
+        return "/tmp/answer_cache/answers.sqlite3"
+    return str(Path(__file__).parents[3] / "answer_cache" / "answers.sqlite3")
+
+
+class AnswerCache:
+    """
+    Two-tier cache for generated answers.
+
+    L1 is a per-process LRU dict; L2 is a SQLite file shared by every worker on
+    the host, so warm answers survive process restarts as long as the file's
+    filesystem does (not the case for /tmp on Render). Entries expire after `ttl_seconds`,
+    each tier is capped by entry count, and entries stored under a different
+    version (corpus fingerprint, prompt template, ...) are never served and are
+    dropped by purge_stale once the full version is known.
+    """
+
+    def __init__(self,
+                 db_path: Optional[str] = None,
+                 ttl_seconds: Optional[int] = None,
+                 l1_max_entries: int = 256,
+                 l2_max_entries: Optional[int] = None):
+        self.db_path = db_path or default_cache_path()
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(
+            os.getenv('ANSWER_CACHE_TTL_SECONDS', str(7 * 24 * 3600))
+        )
+        self.l1_max_entries = l1_max_entries
+        self.l2_max_entries = l2_max_entries if l2_max_entries is not None else int(
+            os.getenv('ANSWER_CACHE_MAX_ENTRIES', '10000')
+        )
+
+        self._lock = threading.Lock()
+        self._l1: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._version_parts: Dict[str, str] = {}
+        self.version = ""
+        self._stats = {
+            'l1_hits': 0,
+            'l2_hits': 0,
+            'misses': 0,
+            'writes': 0,
+            'l1_evictions': 0,
+            'l2_evictions': 0,
+            'expired': 0,
+            'invalidated': 0
+        }
+
+        self._conn = None
+        try:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+            # WAL lets several workers read while one writes
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at)")
+            self._conn.commit()
+            logger.info(f"Using answer cache at: {self.db_path}")
+        except sqlite3.Error as e:
+            # Fall back to L1 only rather than failing requests
+            logger.warning(f"Disk answer cache unavailable at {self.db_path}: {str(e)}")
+            self._conn = None
+
+    def set_version(self, **parts: str):
+        """
+        Update part of the cache version. Lookups only match entries stored under
+        the current version; rows from other versions are left for purge_stale,
+        since a partially known version would otherwise wipe valid entries.
+        """
+        with self._lock:
+            self._version_parts.update(parts)
+            encoded = json.dumps(self._version_parts, sort_keys=True)
+            version = hashlib.sha256(encoded.encode()).hexdigest()[:16]
+            if version == self.version:
+                return
+            self.version = version
+            self._l1.clear()
+
+    def purge_stale(self):
+        """Drop disk entries stored under any version other than the current one"""
+        with self._lock:
+            if self._conn is None:
+                return
+            try:
+                cursor = self._conn.execute("DELETE FROM answers WHERE version != ?", (self.version,))
+                self._conn.commit()
+                self._stats['invalidated'] += cursor.rowcount
+            except sqlite3.Error as e:
+                logger.warning(f"Answer cache invalidation failed: {str(e)}")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._l1.move_to_end(key)
+                    self._stats['l1_hits'] += 1
+                    return value
+                del self._l1[key]
+                self._stats['expired'] += 1
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT value, expires_at, accessed_at FROM answers WHERE key = ? AND version = ?",
+                        (key, self.version)
+                    ).fetchone()
+                    if row is not None:
+                        value, expires_at, accessed_at = row
+                        if expires_at > now:
+                            if now - accessed_at > ACCESS_TOUCH_INTERVAL:
+                                self._conn.execute(
+                                    "UPDATE answers SET accessed_at = ? WHERE key = ?", (now, key)
+                                )
+                                self._conn.commit()
+                            self._put_l1(key, value, expires_at)
+                            self._stats['l2_hits'] += 1
+                            return value
+                        self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                        self._conn.commit()
+                        self._stats['expired'] += 1
+                except sqlite3.Error as e:
+                    logger.warning(f"Answer cache read failed: {str(e)}")
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self._lock:
+            self._put_l1(key, value, expires_at)
+            self._stats['writes'] += 1
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, version, value, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, self.version, value, expires_at, now)
+                )
+                # Evict least recently used rows beyond the size limit
+                cursor = self._conn.execute(
+                    "DELETE FROM answers WHERE key IN ("
+                    "SELECT key FROM answers ORDER BY accessed_at ASC "
+                    "LIMIT MAX(0, (SELECT COUNT(*) FROM answers) - ?))",
+                    (self.l2_max_entries,)
+                )
+                self._stats['l2_evictions'] += cursor.rowcount
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Answer cache write failed: {str(e)}")
+
+    def _put_l1(self, key: str, value: str, expires_at: float):
+        self._l1[key] = (value, expires_at)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_max_entries:
+            self._l1.popitem(last=False)
+            self._stats['l1_evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._l1.clear()
+            if self._conn is not None:
+                try:
+                    self._conn.execute("DELETE FROM answers")
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Answer cache clear failed: {str(e)}")
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus current tier sizes"""
+        with self._lock:
+            l2_entries = None
+            if self._conn is not None:
+                try:
+                    l2_entries = self._conn.execute(
+                        "SELECT COUNT(*) FROM answers WHERE version = ?", (self.version,)
+                    ).fetchone()[0]
+                except sqlite3.Error:
+                    pass
+            lookups = self._stats['l1_hits'] + self._stats['l2_hits'] + self._stats['misses']
+            hits = self._stats['l1_hits'] + self._stats['l2_hits']
+            return {
+                **self._stats,
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'l1_entries': len(self._l1),
+                'l2_entries': l2_entries,
+                'version': self.version,
+                'path': self.db_path if self._conn is not None else None
+            }
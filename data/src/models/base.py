@@ -7,3 +7,7 @@ class BaseLLM(ABC):
     async def generate(self, prompt: str, context: Optional[Dict] = None) -> str:
         """Generate response from the model"""
         pass
+
+    def set_corpus_fingerprint(self, fingerprint: str):
+        """Called after indexing so implementations can invalidate cached answers"""
+        pass
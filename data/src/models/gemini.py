@@ -1,11 +1,12 @@
 # data/src/models/gemini.py
 import google.generativeai as genai
 from typing import Dict, Optional, Tuple
-from functools import lru_cache
+import asyncio
 import hashlib
 import json
 from ..config.env_manager import env_manager
 from .base import BaseLLM
+from .answer_cache import AnswerCache
 import os 
 
 try:
@@ -16,23 +17,69 @@ except ImportError:
     if not GOOGLE_API_KEY:
         raise ValueError("GOOGLE_API_KEY not found in environment variables")
 
+PROMPT_TEMPLATE = """You are a respectful Islamic AI assistant that strictly uses authenticated sources. 
+
+    For questions without relevant sources, respond only with:
+    "I apologize, but I can only provide answers based on authenticated sources in my database. While this can be an important topic in Islam  I don't currently have verified sources about it, But I am improving myself. For accurate guidance, please consult a qualified Islamic scholar."
+
+    Sources:
+    {sources}
+
+    Question: {question}
+
+    Guidelines:
+    1. For matching sources: 
+    - Present a structured, educational response
+    - Use clear headings when appropriate
+    - Include Arabic text with translations
+    - Cite sources inline [Source Name]
+    - Focus on key teachings and wisdom
+
+    2. For no matching sources:
+    - Use the apology message exactly
+    - Never add external information
+    - Never speculate or interpret
+
+    3. Format:
+    - Start with main teaching/principle
+    - Group related points
+    - Include source citations after each point
+    - Use respectful, scholarly tone"""
+
 class GeminiLLM(BaseLLM):
-    def __init__(self):
+    MODEL_NAME = 'gemini-pro'
+
+    def __init__(self, cache: Optional[AnswerCache] = None):
         genai.configure(api_key=env_manager.gemini_key)
-        self.model = genai.GenerativeModel('gemini-pro')
+        self.model = genai.GenerativeModel(self.MODEL_NAME)
+        # Answers stay valid only for this model and prompt template; stale rows
+        # are purged once the corpus fingerprint completes the version
+        self.cache = cache if cache is not None else AnswerCache()
+        self.cache.set_version(
+            model=self.MODEL_NAME,
+            prompt=hashlib.sha256(PROMPT_TEMPLATE.encode()).hexdigest()
+        )
+
+    def set_corpus_fingerprint(self, fingerprint: str):
+        """Invalidate cached answers when the indexed corpus changes"""
+        self.cache.set_version(corpus=fingerprint)
+        self.cache.purge_stale()
         
     def _get_cache_key(self, prompt: str, context: Optional[Dict] = None) -> str:
-        """Create a unique cache key from prompt and context"""
-        # Convert context to a stable string representation
-        context_str = json.dumps(context, sort_keys=True) if context else ""
-        # Combine prompt and context
-        combined = f"{prompt}::{context_str}"
+        """Create a unique cache key from prompt and the retrieved sources"""
+        # Key on which sources were retrieved (in order) and which neighbors the
+        # context window attached, not on raw distances: scores drift in the last
+        # digits between batched and single encodes and would split the cache
+        sources = [
+            [source['source'], [neighbor['source'] for neighbor in source.get('context') or []]]
+            for source in context or []
+        ]
+        combined = json.dumps([prompt, sources], ensure_ascii=False)
         # Create hash for cache key
         return hashlib.md5(combined.encode()).hexdigest()
 
-    @lru_cache(maxsize=100)
-    def _cached_generate(self, cache_key: str, prompt: str) -> str:
-        """Cached version of content generation"""
+    def _generate_content(self, prompt: str) -> str:
+        """Call Gemini with the safety settings applied"""
         response = self.model.generate_content(
             prompt,
             safety_settings=[
@@ -56,47 +103,31 @@ class GeminiLLM(BaseLLM):
         )
         return response.text
 
+    def _format_source(self, source: Dict) -> str:
+        """Render one source, followed by any surrounding verses attached by the retriever"""
+        if source.get('translation'):
+            text = f"- [{source['source']}] {source['translation']}\n  Original: {source['text']}"
+        else:
+            text = f"- [{source['source']}] {source['text']}"
+
+        neighbors = source.get('context') or []
+        if neighbors:
+            text += "\n  Surrounding context:" + "".join(
+                f"\n    [{neighbor['source']}] {neighbor.get('translation') or neighbor['text']}"
+                for neighbor in neighbors
+            )
+        return text
+
     def _construct_prompt(self, question: str, context: Optional[Dict] = None) -> str:
         if not context:
             return question
-                
-        prompt_template = """You are a respectful Islamic AI assistant that strictly uses authenticated sources. 
-
-    For questions without relevant sources, respond only with:
-    "I apologize, but I can only provide answers based on authenticated sources in my database. While this can be an important topic in Islam  I don't currently have verified sources about it, But I am improving myself. For accurate guidance, please consult a qualified Islamic scholar."
-
-    Sources:
-    {sources}
-
-    Question: {question}
-
-    Guidelines:
-    1. For matching sources: 
-    - Present a structured, educational response
-    - Use clear headings when appropriate
-    - Include Arabic text with translations
-    - Cite sources inline [Source Name]
-    - Focus on key teachings and wisdom
-
-    2. For no matching sources:
-    - Use the apology message exactly
-    - Never add external information
-    - Never speculate or interpret
-
-    3. Format:
-    - Start with main teaching/principle
-    - Group related points
-    - Include source citations after each point
-    - Use respectful, scholarly tone"""
 
         sources_text = "\n".join([
-            f"- [{source['source']}] {source.get('translation', '')}\n  Original: {source['text']}"
-            if source.get('translation')
-            else f"- [{source['source']}] {source['text']}"
+            self._format_source(source)
             for source in context
         ])
         
-        return prompt_template.format(
+        return PROMPT_TEMPLATE.format(
             sources=sources_text,
             question=question
         )
@@ -107,8 +138,15 @@ class GeminiLLM(BaseLLM):
             full_prompt = self._construct_prompt(prompt, context)
             cache_key = self._get_cache_key(prompt, context)
             
+            # SQLite lookups and the Gemini call block, so keep them off the event loop
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached is not None:
+                return cached
+
             try:
-                return self._cached_generate(cache_key, full_prompt)
+                answer = await asyncio.to_thread(self._generate_content, full_prompt)
+                await asyncio.to_thread(self.cache.set, cache_key, answer)
+                return answer
             except Exception as e:
                 if "safety" in str(e).lower():
                     return (f"While the sources contain relevant information about {prompt.lower()}, "
@@ -0,0 +1,179 @@
+# data/src/rag/embedding_batcher.py
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingQueueFullError(Exception):
+    """Raised when the embedding queue is saturated and a query is shed"""
+    pass
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches query embeddings across concurrent requests.
+
+    Queries arriving within `max_wait_ms` of each other (or until `max_batch_size`
+    is reached) are encoded in a single forward pass, and every caller gets its own
+    vector back through a future. Once `max_queue_size` queries are waiting, new
+    ones are rejected with EmbeddingQueueFullError instead of growing the latency tail.
+    """
+
+    def __init__(self,
+                 model,
+                 max_batch_size: int = 32,
+                 max_wait_ms: float = 5.0,
+                 max_queue_size: int = 256):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue_size = max_queue_size
+
+        # One encoder thread: batches are serialised, torch parallelises inside each pass
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding-batcher")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._stats = {
+            'requests': 0,
+            'batches': 0,
+            'shed': 0,
+            'largest_batch': 0,
+            'batch_retries': 0
+        }
+
+    def _ensure_worker(self):
+        """Start the batching task on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            if self._worker is not None and self._worker.done() and not self._worker.cancelled():
+                error = self._worker.exception()
+                if error is not None:
+                    logger.error(f"Embedding batcher worker died: {str(error)}")
+            self._fail_pending(RuntimeError("Embedding batcher restarted before this query was encoded"))
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = loop.create_task(self._run())
+
+    def _fail_pending(self, error: Exception):
+        """Resolve every query left in the old queue so its caller doesn't hang"""
+        if self._queue is None:
+            return
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            if not future.done():
+                # Futures belonging to a closed loop can't be resolved anymore
+                if not future.get_loop().is_closed():
+                    future.get_loop().call_soon_threadsafe(
+                        lambda f=future: f.done() or f.set_exception(error)
+                    )
+
+    async def encode(self, text: str) -> np.ndarray:
+        """Queue a query for the next batch and wait for its embedding"""
+        self._ensure_worker()
+        future = self._loop.create_future()
+        try:
+            self._queue.put_nowait((text, future))
+        except asyncio.QueueFull:
+            self._stats['shed'] += 1
+            raise EmbeddingQueueFullError(
+                f"Embedding queue is full ({self.max_queue_size} pending queries), please retry shortly"
+            )
+        self._stats['requests'] += 1
+        return await future
+
+    async def _collect_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """
+        Wait for one query, then gather more until the window closes or the batch
+        is full. Items go straight into the caller's list so none are lost if this
+        is cancelled or fails halfway.
+        """
+        batch.append(await self._queue.get())
+        deadline = self._loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - self._loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=len(texts))
+        return np.asarray(vectors, dtype=np.float32)
+
+    async def _run(self):
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = []
+            try:
+                await self._collect_batch(batch)
+                await self._process_batch(batch)
+            except asyncio.CancelledError:
+                # Callers of dequeued items get an error rather than a cancelled request
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError("Embedding batcher stopped before this query was encoded"))
+                raise
+            except Exception as e:
+                # Fail this batch but keep the worker alive for the next one
+                logger.error(f"Embedding batcher error: {str(e)}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def _process_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """Encode one batch and hand each caller its vector"""
+        # Callers that were cancelled while waiting don't need a vector
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            return
+
+        self._stats['batches'] += 1
+        self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        try:
+            vectors = await self._loop.run_in_executor(
+                self._executor, self._encode_batch, [text for text, _ in batch]
+            )
+        except Exception as e:
+            if len(batch) == 1:
+                raise
+            # One bad query shouldn't fail unrelated requests: retry each on its own
+            logger.warning(f"Batch embedding failed, retrying items individually: {str(e)}")
+            self._stats['batch_retries'] += 1
+            for item in batch:
+                await self._process_single(item)
+            return
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    async def _process_single(self, item: Tuple[str, asyncio.Future]):
+        text, future = item
+        try:
+            vectors = await self._loop.run_in_executor(self._executor, self._encode_batch, [text])
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(vectors[0])
+
+    def stats(self) -> Dict:
+        """Counters for monitoring batching efficiency and load shedding"""
+        batches = self._stats['batches']
+        return {
+            **self._stats,
+            'queue_depth': self._queue.qsize() if self._queue is not None else 0,
+            'average_batch': round(self._stats['requests'] / batches, 2) if batches else 0.0
+        }
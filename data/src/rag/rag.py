@@ -5,23 +5,49 @@ import numpy as np
 import os
 import logging
 import time
-import numpy as np
+import re
+import asyncio
+import hashlib
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sentence_transformers import SentenceTransformer
 from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 from ..models.base import BaseLLM
 from ..models.gemini import GeminiLLM
+from .embedding_batcher import EmbeddingBatcher
 
 logger = logging.getLogger(__name__)
 
+# "Quran 2:184" -> ("Quran", 2, 184); "Sahih al-Bukhari 13" -> ("Sahih al-Bukhari", None, 13)
+REFERENCE_PATTERN = re.compile(r"^(?P<collection>.+?)\s+(?:(?P<chapter>\d+):)?(?P<number>\d+)$")
+
+# Each collection lives in its own shard table; the manifest records what each was built from
+MANIFEST_TABLE = "shard_manifest"
+LEGACY_TABLE = "hadith_quran"
+SHARD_PREFIX = "shard_"
+
+# Sentence embedder for both corpus and queries; part of every shard fingerprint
+EMBEDDING_MODEL = "all-mpnet-base-v2"
+
 class IslamicRAG:
     def __init__(self, 
                  data_path: str = str(Path(__file__).parents[2] / "processed" / "islamic_data.json"),
                  db_path: str = str(Path(__file__).parents[3] / "islamic_db"),
                  database_dir: str = None,
-                 llm: Optional[BaseLLM] = None):
+                 llm: Optional[BaseLLM] = None,
+                 query_batcher: Optional[EmbeddingBatcher] = None):
 
-        self.model = SentenceTransformer("all-mpnet-base-v2")
+        self.model = SentenceTransformer(EMBEDDING_MODEL)
+
+        # Concurrent questions share one forward pass for their query embeddings
+        self.query_batcher = query_batcher if query_batcher is not None else EmbeddingBatcher(
+            self.model,
+            max_batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', '32')),
+            max_wait_ms=float(os.getenv('EMBEDDING_BATCH_WAIT_MS', '5')),
+            max_queue_size=int(os.getenv('EMBEDDING_QUEUE_SIZE', '256'))
+        )
         
         # Determine database path with priority order:
         # 1. Environment variable
@@ -46,43 +72,190 @@ class IslamicRAG:
         self.db = lancedb.connect(db_path)
         self.vector_dim = 768
         self.llm = llm if llm is not None else GeminiLLM()
+        self.data_path = data_path
+        # Normalised source -> row, plus the rows of each collection so one
+        # collection's part of the index can be replaced on its own.
+        # These dicts are never mutated once published: a rebuild builds new
+        # ones and swaps them in under index_lock, together with self.shards
+        self.reference_index: Dict[str, Dict] = {}
+        self.collection_rows: Dict[str, List[Dict]] = {}
+        self.shards: Dict[str, Dict] = {}
+        self.index_lock = threading.Lock()
+        # Serialises rebuilds so two of them never start from the same snapshot
+        self.rebuild_lock = threading.Lock()
+        # Shared pool for fanning a query out over the shards
+        self.search_executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv('SHARD_SEARCH_WORKERS', str(min(8, os.cpu_count() or 1)))),
+            thread_name_prefix="shard-search"
+        )
         self.setup_database(data_path)
     
     def determine_type(self, source: str) -> str:
         return "quran" if "Quran" in source else "hadith"
     
-    def setup_database(self, data_path: str):
-        """Initialize the database with proper vector column"""
-        # Load data
-        print("Loading data...")
-        with open(data_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        print("Preparing embeddings...")
-        documents = []
-        for item in data:
-            # Get text for embedding (prefer translation if available)
-            text_for_embedding = item.get('translation', item['text'])
-            
-            # Create embedding with correct type
-            vector = self.model.encode(text_for_embedding)
-            vector = vector.astype(np.float32).tolist()
-            
-            # Create document with all necessary fields
-            doc = {
+    def parse_reference(self, source: str) -> Optional[Tuple[str, Optional[int], int]]:
+        """Split a source string into (collection, chapter, number)"""
+        match = REFERENCE_PATTERN.match(source.strip())
+        if not match:
+            return None
+        chapter = match.group('chapter')
+        return (
+            match.group('collection'),
+            int(chapter) if chapter is not None else None,
+            int(match.group('number'))
+        )
+
+    def format_reference(self, collection: str, chapter: Optional[int], number: int) -> str:
+        """Inverse of parse_reference"""
+        if chapter is not None:
+            return f"{collection} {chapter}:{number}"
+        return f"{collection} {number}"
+
+    def reference_key(self, source: str) -> str:
+        """Normalise a source so lookups built by format_reference always match"""
+        parsed = self.parse_reference(source)
+        return self.format_reference(*parsed) if parsed else source.strip()
+
+    def index_collection_rows(self, collection: str, documents: List[Dict],
+                              reference_index: Dict[str, Dict],
+                              collection_rows: Dict[str, List[Dict]]):
+        """
+        Map every source string (surah:ayah, collection number) of one collection to
+        its row, replacing that collection's previous entries in the given dicts
+        """
+        for row in collection_rows.pop(collection, []):
+            reference_index.pop(self.reference_key(row['source']), None)
+
+        rows = []
+        for doc in documents:
+            row = {key: value for key, value in doc.items() if key != 'vector'}
+            key = self.reference_key(row['source'])
+            if key in reference_index:
+                logger.warning(f"Duplicate source in corpus: {row['source']}")
+                continue
+            reference_index[key] = row
+            rows.append(row)
+        collection_rows[collection] = rows
+
+    def get_neighbors(self, source: str, window: int, exclude: Optional[set] = None,
+                      reference_index: Optional[Dict[str, Dict]] = None) -> List[Dict]:
+        """
+        Return up to `window` rows before and after `source` in the same collection.
+        Sources whose reference key is in `exclude` are skipped, and the keys of
+        the returned rows are added to it. `reference_index` defaults to the live one.
+        """
+        if reference_index is None:
+            reference_index = self.reference_index
+        parsed = self.parse_reference(source)
+        if not parsed or window <= 0:
+            return []
+
+        collection, chapter, number = parsed
+        neighbors = []
+        for offset in range(-window, window + 1):
+            if offset == 0:
+                continue
+            key = self.format_reference(collection, chapter, number + offset)
+            if exclude is not None and key in exclude:
+                continue
+            row = reference_index.get(key)
+            if row is not None:
+                neighbors.append(dict(row))
+                if exclude is not None:
+                    exclude.add(key)
+        return neighbors
+
+    def collection_name(self, source: str) -> str:
+        """Collection a source belongs to, e.g. 'Quran' or 'Sahih al-Bukhari'"""
+        parsed = self.parse_reference(source)
+        return parsed[0] if parsed else source.strip()
+
+    def shard_table_name(self, collection: str) -> str:
+        """LanceDB table holding one collection"""
+        slug = re.sub(r"[^a-z0-9]+", "_", collection.lower()).strip("_")
+        return f"{SHARD_PREFIX}{slug}"
+
+    def collection_fingerprint(self, items: List[Dict]) -> str:
+        """Changes whenever a collection's content (or the embedder) changes"""
+        encoded = json.dumps(items, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256((encoded + EMBEDDING_MODEL).encode('utf-8')).hexdigest()
+
+    def make_documents(self, items: List[Dict], with_vectors: bool = True) -> List[Dict]:
+        """Turn raw corpus items into table rows, batch-encoding their text"""
+        documents = [
+            {
                 'text': item['text'],
                 'translation': item.get('translation', ''),
                 'source': item['source'],
-                'type': self.determine_type(item['source']),
-                'vector': vector
+                'type': self.determine_type(item['source'])
             }
-            documents.append(doc)
-        
-        print("Setting up database...")
-        # Create or recreate the table
-        if "hadith_quran" in self.db.table_names():
-            print("Removing existing table...")
-            self.db.drop_table("hadith_quran")
+            for item in items
+        ]
+        if with_vectors and documents:
+            # Get text for embedding (prefer translation if available)
+            texts = [item.get('translation', item['text']) for item in items]
+            vectors = self.model.encode(texts, batch_size=64)
+            for doc, vector in zip(documents, vectors):
+                doc['vector'] = np.asarray(vector, dtype=np.float32).tolist()
+        return documents
+
+    def load_manifest(self) -> Dict[str, Dict]:
+        """Read which shard tables exist and what content they were built from"""
+        if MANIFEST_TABLE not in self.db.table_names():
+            return {}
+        manifest = self.db.open_table(MANIFEST_TABLE).to_pandas()
+        return {row['collection']: row.to_dict() for _, row in manifest.iterrows()}
+
+    def save_manifest(self, shards: Dict[str, Dict]):
+        records = [
+            {
+                'collection': collection,
+                'table_name': shard['table_name'],
+                'type': shard['type'],
+                'fingerprint': shard['fingerprint']
+            }
+            for collection, shard in shards.items()
+        ]
+        schema = pa.schema([
+            pa.field('collection', pa.string()),
+            pa.field('table_name', pa.string()),
+            pa.field('type', pa.string()),
+            pa.field('fingerprint', pa.string())
+        ])
+        table = self.db.create_table(MANIFEST_TABLE, schema=schema, mode="overwrite")
+        if records:
+            table.add(records)
+
+    def update_corpus_fingerprint(self, shards: Dict[str, Dict]):
+        """Combine the per-collection fingerprints and invalidate stale cached answers"""
+        encoded = json.dumps(
+            sorted((collection, shard['fingerprint']) for collection, shard in shards.items())
+        )
+        self.corpus_fingerprint = hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+        # Cached answers are only valid for the corpus they were retrieved from
+        self.llm.set_corpus_fingerprint(self.corpus_fingerprint)
+
+    def check_table_name(self, collection: str, owners: Dict[str, str]):
+        """Refuse collections whose names map to the same shard table"""
+        table_name = self.shard_table_name(collection)
+        owner = owners.get(table_name)
+        if owner is not None and owner != collection:
+            raise ValueError(
+                f"Collections '{owner}' and '{collection}' both map to shard table '{table_name}'"
+            )
+        owners[table_name] = collection
+
+    def write_shard(self, collection: str, items: List[Dict]) -> Tuple[Dict, List[Dict]]:
+        """
+        Embed a collection into a new shard table named after its content, so the
+        live table keeps serving searches until the caller swaps the entry in
+        Returns:
+            Tuple[Dict, List[Dict]]: Shard entry and the rows written, without vectors
+        """
+        print(f"Indexing {collection} ({len(items)} items)...")
+        documents = self.make_documents(items)
+        fingerprint = self.collection_fingerprint(items)
+        table_name = f"{self.shard_table_name(collection)}__{fingerprint[:12]}"
 
         # Create schema with fixed-length vector
         schema = pa.schema([
@@ -92,38 +265,212 @@ class IslamicRAG:
             pa.field('type', pa.string()),
             pa.field('vector', pa.list_(pa.float32(), self.vector_dim))
         ])
-        
-        # Create table with vector column
-        self.table = self.db.create_table(
-            "hadith_quran",
-            schema=schema,
-            mode="overwrite"
-        )
-        
-        # Insert data
-        print("Inserting data...")
-        self.table.add(documents)
+        table = self.db.create_table(table_name, schema=schema, mode="overwrite")
+        table.add(documents)
+
+        shard = {
+            'table': table,
+            'table_name': table_name,
+            'type': self.determine_type(collection),
+            'fingerprint': fingerprint
+        }
+        return shard, [{key: value for key, value in doc.items() if key != 'vector'} for doc in documents]
+
+    def save_corpus_items(self, collection: str, items: List[Dict]):
+        """Replace one collection's items in the corpus JSON file, keeping the others in place"""
+        with open(self.data_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        updated = []
+        inserted = False
+        for item in data:
+            if self.collection_name(item['source']) != collection:
+                updated.append(item)
+            elif not inserted:
+                updated.extend(items)
+                inserted = True
+        if not inserted:
+            updated.extend(items)
+
+        # Write to a temporary file first so a crash never leaves a truncated corpus
+        tmp_path = f"{self.data_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(updated, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.data_path)
+
+    def rebuild_collection(self, collection: str, items: List[Dict], persist: bool = True):
+        """
+        Reindex a single collection without touching the others. The new shard is
+        built alongside the live one and swapped in atomically with the reference
+        index, so concurrent searches see either the old or the new collection.
+        The superseded table is dropped on the next startup.
+        Args:
+            collection: Collection name, e.g. 'Sahih Muslim'
+            items: Raw corpus items belonging to that collection
+            persist: Also write the items to the corpus JSON file, so the next
+                startup keeps this index instead of re-embedding the old content
+        """
+        with self.rebuild_lock:
+            owners = {self.shard_table_name(name): name for name in self.shards}
+            self.check_table_name(collection, owners)
+
+            shard, rows = self.write_shard(collection, items)
+            if persist:
+                self.save_corpus_items(collection, items)
+
+            # Build the next snapshot off to the side, then publish it in one step
+            shards = dict(self.shards)
+            shards[collection] = shard
+            reference_index = dict(self.reference_index)
+            collection_rows = dict(self.collection_rows)
+            self.index_collection_rows(collection, rows, reference_index, collection_rows)
+            with self.index_lock:
+                self.shards = shards
+                self.reference_index = reference_index
+                self.collection_rows = collection_rows
+
+            self.save_manifest(shards)
+            self.update_corpus_fingerprint(shards)
+
+    def setup_database(self, data_path: str):
+        """Initialize one table per collection, re-embedding only collections that changed"""
+        # Load data
+        print("Loading data...")
+        with open(data_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        # Partition the corpus by collection, keeping corpus order within each
+        collections: Dict[str, List[Dict]] = {}
+        for item in data:
+            collections.setdefault(self.collection_name(item['source']), []).append(item)
+
+        # Two collections sharing a shard table would silently overwrite each other
+        owners: Dict[str, str] = {}
+        for collection in collections:
+            self.check_table_name(collection, owners)
+
+        print("Setting up database...")
+        # Drop the pre-partitioning single table if it is still around
+        if LEGACY_TABLE in self.db.table_names():
+            print("Removing legacy table...")
+            self.db.drop_table(LEGACY_TABLE)
+
+        manifest = self.load_manifest()
+        existing_tables = set(self.db.table_names())
+        shards: Dict[str, Dict] = {}
+        rows_by_collection: Dict[str, List[Dict]] = {}
+        for collection, items in collections.items():
+            entry = manifest.get(collection)
+            if (entry is not None
+                    and entry['fingerprint'] == self.collection_fingerprint(items)
+                    and entry['table_name'] in existing_tables):
+                print(f"Reusing index for {collection}")
+                shards[collection] = {
+                    'table': self.db.open_table(entry['table_name']),
+                    'table_name': entry['table_name'],
+                    'type': self.determine_type(collection),
+                    'fingerprint': entry['fingerprint']
+                }
+                rows_by_collection[collection] = self.make_documents(items, with_vectors=False)
+            else:
+                shards[collection], rows_by_collection[collection] = self.write_shard(collection, items)
+
+        # Remove shards of collections no longer in the corpus and tables superseded by rebuilds
+        live_tables = {shard['table_name'] for shard in shards.values()}
+        for table_name in existing_tables:
+            if (table_name.startswith(SHARD_PREFIX)
+                    and table_name != MANIFEST_TABLE
+                    and table_name not in live_tables):
+                print(f"Removing stale shard {table_name}...")
+                self.db.drop_table(table_name)
+        self.save_manifest(shards)
+
+        print("Building reference index...")
+        reference_index: Dict[str, Dict] = {}
+        collection_rows: Dict[str, List[Dict]] = {}
+        for collection, rows in rows_by_collection.items():
+            self.index_collection_rows(collection, rows, reference_index, collection_rows)
+
+        with self.index_lock:
+            self.shards = shards
+            self.reference_index = reference_index
+            self.collection_rows = collection_rows
+
+        self.update_corpus_fingerprint(shards)
         print("Database setup complete!")
-    
-    def search(self, query: str, source_type: str = None, limit: int = 3) -> List[Dict]:
-        """Search the database with proper vector column specification"""
+
+    def search(self, query: str, source_type: str = None, limit: int = 3,
+               context_window: int = 0) -> List[Dict]:
+        """
+        Search the database with proper vector column specification
+        Args:
+            query: Search text
+            source_type: Filter by 'hadith' or 'quran'
+            limit: Number of results to return
+            context_window: Attach up to this many neighboring verses/hadith on
+                each side of every result, looked up in the reference index
+        Returns:
+            List[Dict]: Matching sources, closest first
+        """
         # Encode query with correct type
         query_vector = self.model.encode(query)
-        query_vector = query_vector.astype(np.float32).tolist()
-        
-        # Start search query with explicit vector column
-        search_query = self.table.search(query_vector, vector_column_name="vector")
-        
-        # Add type filter if specified
-        if source_type in ['hadith', 'quran']:
-            search_query = search_query.where(f"type = '{source_type}'")
-        
-        # Execute search and get results
-        results = search_query.limit(limit).to_pandas()
+        return self.search_by_vector(query_vector, source_type, limit, context_window)
+
+    async def asearch(self, query: str, source_type: str = None, limit: int = 3,
+                      context_window: int = 0) -> List[Dict]:
+        """
+        Async variant of search that batches the query embedding with other
+        in-flight requests. Raises EmbeddingQueueFullError when saturated.
+        """
+        query_vector = await self.query_batcher.encode(query)
+        # Keep the event loop free to gather the next batch while LanceDB runs
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.search_by_vector, query_vector, source_type, limit, context_window
+        )
+
+    def search_by_vector(self, query_vector: np.ndarray, source_type: str = None, limit: int = 3,
+                         context_window: int = 0) -> List[Dict]:
+        """Run the vector search for an already encoded query"""
+        query_vector = np.asarray(query_vector, dtype=np.float32).tolist()
+
+        # Work on one consistent snapshot even if a rebuild swaps in a new one meanwhile
+        with self.index_lock:
+            all_shards = self.shards
+            reference_index = self.reference_index
+
+        # Only fan out to shards that can hold the requested type
+        shards = [
+            shard for shard in all_shards.values()
+            if source_type not in ['hadith', 'quran'] or shard['type'] == source_type
+        ]
+        if not shards:
+            return []
+
+        def search_shard(shard: Dict) -> List[Dict]:
+            # Start search query with explicit vector column
+            results = shard['table'].search(query_vector, vector_column_name="vector")
+            return results.limit(limit).to_pandas().to_dict('records')
+
+        if len(shards) == 1:
+            candidates = search_shard(shards[0])
+        else:
+            candidates = [
+                row
+                for rows in self.search_executor.map(search_shard, shards)
+                for row in rows
+            ]
+
+        # Merge per-shard top-k into a global top-k by distance
+        results = heapq.nsmallest(limit, candidates, key=lambda row: row['_distance'])
         
+        # Every verse/hadith reaches the prompt once: skip neighbors that are
+        # hits themselves or were already attached to an earlier hit
+        seen = {self.reference_key(row['source']) for row in results}
+
         # Format results
         formatted_results = []
-        for _, row in results.iterrows():
+        for row in results:
             result = {
                 'text': row['text'],
                 'translation': row['translation'],
@@ -131,22 +478,28 @@ class IslamicRAG:
                 'type': row['type'],
                 'score': float(row['_distance'])
             }
+            if context_window > 0:
+                result['context'] = self.get_neighbors(
+                    row['source'], context_window, exclude=seen, reference_index=reference_index
+                )
             formatted_results.append(result)
             
         return formatted_results
 
-    async def answer_question(self, query: str, source_type: str = None, limit: int = 3) -> Tuple[str, List[Dict]]:
+    async def answer_question(self, query: str, source_type: str = None, limit: int = 3,
+                              context_window: int = 0) -> Tuple[str, List[Dict]]:
         """
         Answer a question using RAG and LLM
         Args:
             query: User question
             source_type: Filter by 'hadith' or 'quran'
             limit: Number of sources to retrieve
+            context_window: Number of neighboring verses/hadith to attach per source
         Returns:
             Tuple[str, List[Dict]]: Generated answer and retrieved sources
         """
         # Get relevant sources
-        sources = self.search(query, source_type, limit)
+        sources = await self.asearch(query, source_type, limit, context_window)
         
         if not sources:
             return "I apologize, but I can only provide answers based on the authenticated sources in my database. While this can be an important topic in Islam, I don't currently have verified sources about it, But I am improving myself. For accurate guidance on this matter, I recommend consulting a qualified Islamic scholar or reliable Islamic resources.", []
@@ -5,6 +5,10 @@ import sys
 from pathlib import Path
 import time
 import argparse
+import json
+import tempfile
+import numpy as np
+import pandas as pd
 
 # Add the project root to Python path
 project_root = Path(__file__).parents[2]
@@ -12,6 +16,7 @@ sys.path.append(str(project_root))
 
 from data.src.rag.rag import IslamicRAG
 from data.src.config.env_manager import env_manager
+from data.src.models.answer_cache import AnswerCache
 
 async def test_regular_queries(rag):
     """Test regular queries"""
@@ -70,11 +75,130 @@ async def test_caching(rag):
     print(f"Second call time: {second_call_time:.2f} seconds")
     print(f"Time saved: {(first_call_time - second_call_time):.2f} seconds")
     print(f"Responses match: {answer1 == answer2}")
+    if getattr(rag.llm, 'cache', None):
+        print(f"Cache stats: {rag.llm.cache.stats()}")
+
+async def test_context_window(rag):
+    """Test neighbor expansion from the reference index"""
+    print("\n" + "="*50)
+    print("Testing Context Window")
+    print("="*50)
+
+    test_query = "Fasting is prescribed for you"
+    results = rag.search(test_query, "quran", limit=2, context_window=2)
+    for result in results:
+        print(f"\nSource: {result['source']}")
+        print("Neighbors: " + ", ".join(neighbor['source'] for neighbor in result['context']))
+
+    # Lookups go through the index, so a known verse should resolve directly
+    neighbors = rag.get_neighbors("Quran 1:4", 1)
+    print(f"\nNeighbors of Quran 1:4: {[neighbor['source'] for neighbor in neighbors]}")
+
+async def test_batching(rag):
+    """Test micro-batching of concurrent query embeddings"""
+    print("\n" + "="*50)
+    print("Testing Embedding Batching")
+    print("="*50)
+
+    queries = [f"What does Islam say about charity? ({i})" for i in range(16)]
+
+    start_time = time.time()
+    results = await asyncio.gather(*[rag.asearch(query) for query in queries])
+    batched_time = time.time() - start_time
+
+    start_time = time.time()
+    for query in queries:
+        rag.search(query)
+    sequential_time = time.time() - start_time
+
+    print(f"Concurrent (batched) time: {batched_time:.2f} seconds")
+    print(f"Sequential time:           {sequential_time:.2f} seconds")
+    print(f"All queries answered: {all(results)}")
+    print(f"Batcher stats: {rag.query_batcher.stats()}")
+
+async def test_shards(rag):
+    """Test per-collection shards, fan-out search and single-collection rebuilds"""
+    print("\n" + "="*50)
+    print("Testing Collection Shards")
+    print("="*50)
+
+    for collection, shard in rag.shards.items():
+        print(f"{collection}: table={shard['table_name']} type={shard['type']}")
+
+    query = "What does Islam say about intentions?"
+    for source_type in [None, "hadith", "quran"]:
+        start_time = time.time()
+        results = rag.search(query, source_type, limit=5)
+        elapsed = time.time() - start_time
+        print(f"\nSource Type: {source_type if source_type else 'all'} ({elapsed:.3f} seconds)")
+        for result in results:
+            print(f"   {result['source']} ({result['type']}) score={result['score']:.4f}")
+
+    # The merged fan-out top-k must match one search over all rows in a single table
+    print("\nComparing fan-out search with a single-table search...")
+    query_vector = rag.model.encode(query)
+    combined = pd.concat([shard['table'].to_pandas() for shard in rag.shards.values()])
+    single_table = rag.db.create_table("fanout_check", data=combined, mode="overwrite")
+    try:
+        for limit in [1, 5, 10]:
+            expected = single_table.search(
+                query_vector.astype(np.float32).tolist(), vector_column_name="vector"
+            ).limit(limit).to_pandas()
+            fanned_out = rag.search_by_vector(query_vector, limit=limit)
+            assert [round(r['score'], 4) for r in fanned_out] == \
+                [round(float(d), 4) for d in expected['_distance']], f"top-{limit} distances differ"
+            assert {r['source'] for r in fanned_out} == set(expected['source']), f"top-{limit} sources differ"
+        print("Fan-out top-k matches single-table search")
+    finally:
+        rag.db.drop_table("fanout_check")
+
+    # Rebuild one hadith collection and check only it changes
+    collection = next(name for name, shard in rag.shards.items() if shard['type'] == 'hadith')
+    with open(rag.data_path, 'r', encoding='utf-8') as f:
+        original = [item for item in json.load(f) if rag.collection_name(item['source']) == collection]
+    last_number = max(rag.parse_reference(item['source'])[2] for item in original)
+    last_source = rag.format_reference(collection, None, last_number)
+    new_source = rag.format_reference(collection, None, last_number + 1)
+    new_text = "Whoever keeps his promises and returns what is entrusted to him is among the believers."
+    modified = original + [{'text': new_text, 'translation': new_text, 'source': new_source}]
+
+    others_before = {
+        name: (shard['table_name'], shard['fingerprint'])
+        for name, shard in rag.shards.items() if name != collection
+    }
+    quran_neighbors_before = rag.get_neighbors("Quran 1:4", 1)
+
+    print(f"\nRebuilding {collection} with an extra hadith {new_source}...")
+    rag.rebuild_collection(collection, modified, persist=False)
+    try:
+        results = rag.search(new_text, "hadith", limit=3, context_window=1)
+        print(f"Results: {[result['source'] for result in results]}")
+        assert results[0]['source'] == new_source, "rebuilt collection not searchable"
+        neighbors = [neighbor['source'] for neighbor in rag.get_neighbors(last_source, 1)]
+        print(f"Neighbors of {last_source}: {neighbors}")
+        assert new_source in neighbors, "reference index not refreshed"
+
+        others_after = {
+            name: (shard['table_name'], shard['fingerprint'])
+            for name, shard in rag.shards.items() if name != collection
+        }
+        assert others_after == others_before, "other collections were rebuilt"
+        assert rag.get_neighbors("Quran 1:4", 1) == quran_neighbors_before
+        print("Only the rebuilt collection changed")
+    finally:
+        rag.rebuild_collection(collection, original, persist=False)
+
+    assert rag.reference_key(new_source) not in rag.reference_index
+    assert all(result['source'] != new_source for result in rag.search(new_text, "hadith", limit=3))
+    print(f"{collection} restored")
 
 async def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Test Islamic RAG system')
     parser.add_argument('--test-cache', action='store_true', help='Run cache testing')
+    parser.add_argument('--test-context', action='store_true', help='Run context window testing')
+    parser.add_argument('--test-batching', action='store_true', help='Run embedding batching testing')
+    parser.add_argument('--test-shards', action='store_true', help='Run collection shard testing')
     args = parser.parse_args()
 
     # Initialize the RAG system
@@ -86,7 +210,20 @@ async def main():
     
     # Run cache tests only if flag is provided
     if args.test_cache:
+        test_cache_persistence()
         await test_caching(rag)
 
+    # Run context window tests only if flag is provided
+    if args.test_context:
+        await test_context_window(rag)
+
+    # Run batching tests only if flag is provided
+    if args.test_batching:
+        await test_batching(rag)
+
+    # Run shard tests only if flag is provided
+    if args.test_shards:
+        await test_shards(rag)
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file